@@ -1,218 +1,193 @@
 # app.py - Full Smart Queue System (all tabs + payment_type migration + analytics)
 import streamlit as st
-import sqlite3
 import pandas as pd
-import datetime
-import random
-import os
-from gtts import gTTS
-from streamlit_autorefresh import st_autorefresh
-import matplotlib.pyplot as plt
-from difflib import get_close_matches
-
-# ----------------- DB SETUP & MIGRATION -----------------
-DB_PATH = "hospital.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-c = conn.cursor()
-
-def table_columns(table):
-    c.execute(f"PRAGMA table_info({table})")
-    return [r[1] for r in c.fetchall()]
-
-# Create or migrate patients table
-c.execute("SELECT name FROM sqlite_master WHERE type='table'")
-existing_tables = [r[0] for r in c.fetchall()]
-
-if "patients" in existing_tables:
-    pcols = table_columns("patients")
-    if "name" in pcols and "first_name" not in pcols:
-        # migrate old patients -> new structure
-        c.execute("ALTER TABLE patients RENAME TO patients_old")
-        conn.commit()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                first_name TEXT,
-                middle_name TEXT,
-                surname TEXT,
-                age INTEGER,
-                gender TEXT,
-                weight REAL,
-                height REAL,
-                bp TEXT,
-                condition TEXT
-            )
-        ''')
-        conn.commit()
-        c.execute("SELECT id, name, age, gender, condition FROM patients_old")
-        for row in c.fetchall():
-            _, fullname, age, gender, condition = row
-            if fullname and isinstance(fullname, str):
-                parts = fullname.strip().split()
-                if len(parts) == 1:
-                    first, middle, surname = parts[0], "", ""
-                elif len(parts) == 2:
-                    first, middle, surname = parts[0], "", parts[1]
-                else:
-                    first, middle, surname = parts[0], " ".join(parts[1:-1]), parts[-1]
-            else:
-                first = middle = surname = ""
-            c.execute("""
-                INSERT INTO patients (first_name, middle_name, surname, age, gender, condition)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (first, middle, surname, age, gender, condition))
-        conn.commit()
-        c.execute("DROP TABLE IF EXISTS patients_old")
-        conn.commit()
-else:
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS patients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            first_name TEXT,
-            middle_name TEXT,
-            surname TEXT,
-            age INTEGER,
-            gender TEXT,
-            weight REAL,
-            height REAL,
-            bp TEXT,
-            condition TEXT
-        )
-    ''')
-    conn.commit()
-
-# Create or migrate queue table
-if "queue" not in existing_tables:
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS queue (
-            queue_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            patient_id INTEGER,
-            ticket_number TEXT,
-            entry_time TEXT,
-            exit_time TEXT,
-            location TEXT,
-            status TEXT DEFAULT "waiting",
-            destination TEXT,
-            payment_type TEXT,
-            FOREIGN KEY(patient_id) REFERENCES patients(id)
-        )
-    ''')
-    conn.commit()
-else:
-    qcols = table_columns("queue")
-    # add columns if missing
-    for col_def in [("ticket_number", "TEXT"), ("entry_time", "TEXT"), ("exit_time", "TEXT"),
-                    ("location", "TEXT"), ("destination", "TEXT"), ("payment_type", "TEXT")]:
-        col, dtype = col_def
-        if col not in qcols:
-            try:
-                c.execute(f"ALTER TABLE queue ADD COLUMN {col} {dtype}")
-            except Exception:
-                pass
-    # if old 'time' exists, copy it to entry_time where entry_time is null
-    if "time" in qcols and "entry_time" in qcols:
-        try:
-            c.execute("UPDATE queue SET entry_time = time WHERE (entry_time IS NULL OR entry_time='') AND time IS NOT NULL")
-        except Exception:
-            pass
-    conn.commit()
+import io
+import importlib.util
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from db import (
+    data_version, add_patient, update_patient, upsert_patients, add_to_queue,
+    update_triage_by_ids, update_doctor_by_ids, mark_done_by_queue,
+    get_waiting_df, queue_counts, tv_poller, get_analytics, get_patients_df,
+    get_station_queue, get_patient, search_records,
+)
 
 # ----------------- UTILS -----------------
-def generate_ticket():
-    return f"T{datetime.datetime.now().strftime('%y%m%d%H%M%S%f')[-12:]}"
-
-def split_fullname(fullname):
-    if not fullname or not isinstance(fullname, str):
-        return "", "", ""
-    parts = fullname.strip().split()
-    if len(parts) == 1:
-        return parts[0], "", ""
-    elif len(parts) == 2:
-        return parts[0], "", parts[1]
-    else:
-        return parts[0], " ".join(parts[1:-1]), parts[-1]
-
-def safe_remove_file(path):
-    try:
-        if os.path.exists(path):
-            os.remove(path)
-    except Exception:
-        pass
-
-# ----------------- CRUD / FLOW FUNCTIONS -----------------
-def add_patient(first_name, middle_name, surname, age, gender):
-    c.execute("INSERT INTO patients (first_name, middle_name, surname, age, gender) VALUES (?, ?, ?, ?, ?)",
-              (first_name, middle_name, surname, age, gender))
-    conn.commit()
-    return c.lastrowid
-
-def update_patient(pid, first_name, middle_name, surname, age, gender, weight=None, height=None, bp=None, condition=None):
-    c.execute("""
-        UPDATE patients
-        SET first_name=?, middle_name=?, surname=?, age=?, gender=?, weight=?, height=?, bp=?, condition=?
-        WHERE id=?
-    """, (first_name, middle_name, surname, age, gender, weight, height, bp, condition, pid))
-    conn.commit()
-
-def add_to_queue(patient_id, destination=None):
-    ticket = generate_ticket()
-    entry_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    loc = "Entry"
-    dest = destination or "Triage"
-    c.execute("INSERT INTO queue (patient_id, ticket_number, entry_time, location, destination, status) VALUES (?, ?, ?, ?, ?, ?)",
-              (patient_id, ticket, entry_time, loc, dest, "waiting"))
-    conn.commit()
-    return ticket
-
-def update_triage_by_ids(patient_id, queue_id=None, weight=None, height=None, bp=None):
-    c.execute("UPDATE patients SET weight=?, height=?, bp=? WHERE id=?", (weight, height, bp, patient_id))
-    # update queue row(s)
-    c.execute("UPDATE queue SET location='Triage', destination='Consultation' WHERE patient_id=?", (patient_id,))
-    conn.commit()
-
-def update_doctor_by_ids(patient_id, condition, destination):
-    c.execute("UPDATE patients SET condition=? WHERE id=?", (condition, patient_id))
-    c.execute("UPDATE queue SET location='Doctor', destination=?, status='waiting' WHERE patient_id=?", (destination, patient_id))
-    conn.commit()
-
-def mark_done_by_queue(queue_id, section, payment_type=None):
-    exit_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    if section == "Payment" and payment_type:
-        c.execute("UPDATE queue SET location=?, status='done', exit_time=?, payment_type=? WHERE queue_id=?",
-                  (section, exit_time, payment_type, queue_id))
-    else:
-        c.execute("UPDATE queue SET location=?, status='done', exit_time=? WHERE queue_id=?",
-                  (section, exit_time, queue_id))
-    conn.commit()
-
-def get_queue_df():
-    try:
-        return pd.read_sql("""
-            SELECT q.queue_id, q.patient_id, q.ticket_number,
-                   COALESCE(p.first_name,'') || ' ' || COALESCE(p.middle_name,'') || ' ' || COALESCE(p.surname,'') as full_name,
-                   p.age, p.gender, p.weight, p.height, p.bp, p.condition,
-                   q.location, q.status, q.destination, q.payment_type, q.entry_time, q.exit_time
-            FROM queue q
-            LEFT JOIN patients p ON q.patient_id = p.id
-            ORDER BY q.queue_id ASC
-        """, conn)
-    except Exception as e:
-        st.error(f"DB error: {e}")
-        return pd.DataFrame()
+UPLOAD_COLUMNS = ["first_name", "middle_name", "surname", "age", "gender", "weight", "height", "bp", "condition"]
+# explicit dtypes skip pandas' inference pass; numbers are read as text too, since clinic sheets
+# carry cells like "70kg", and prepare_upload_df() coerces them
+UPLOAD_DTYPES = {col: "string" for col in ["name"] + UPLOAD_COLUMNS}
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+def read_upload(file):
+    """Parse an uploaded CSV/Excel sheet, reading only the columns prepare_upload_df() can use."""
+    if file.name.endswith(".csv"):
+        # the pyarrow engine only accepts an explicit usecols list, so read the header row first
+        header = pd.read_csv(file, nrows=0).columns
+        file.seek(0)
+        usecols = [col for col in header if col in UPLOAD_DTYPES]
+        if not usecols:
+            # nothing we can use; pyarrow would take an empty usecols as "every column"
+            return pd.DataFrame()
+        try:
+            return pd.read_csv(file, usecols=usecols, dtype=UPLOAD_DTYPES, engine=CSV_ENGINE)
+        except pd.errors.ParserError:
+            if CSV_ENGINE == "c":
+                raise
+            # pyarrow rejects short rows; the C engine pads the missing cells with NA
+            file.seek(0)
+            return pd.read_csv(file, usecols=usecols, dtype=UPLOAD_DTYPES, engine="c")
+    return pd.read_excel(file, usecols=lambda col: col in UPLOAD_DTYPES, dtype=UPLOAD_DTYPES, engine="openpyxl")
+
+def prepare_upload_df(df):
+    """Normalize an uploaded sheet to UPLOAD_COLUMNS, splitting a full 'name' column where needed."""
+    df = df.copy()
+    for col in UPLOAD_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    if "name" in df.columns:
+        use_name = df["name"].notna() & df["first_name"].isna()
+        if use_name.any():
+            # first word, last word, everything between as middle
+            names = df.loc[use_name, "name"].astype("string").str.split().str.join(" ")
+            first = names.str.partition(" ")
+            rest = first[2].str.rpartition(" ")
+            df.loc[use_name, "first_name"] = first[0]
+            df.loc[use_name, "middle_name"] = rest[0]
+            df.loc[use_name, "surname"] = rest[2]
+    for col in ("first_name", "middle_name", "surname", "gender"):
+        df[col] = df[col].fillna("")
+    df["age"] = pd.to_numeric(df["age"], errors="coerce").fillna(0).astype(int)
+    for col in ("weight", "height"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    df = df[UPLOAD_COLUMNS].astype(object)
+    return df.where(df.notna(), None)
+
+FAQ = {
+    "register": "📝 Register at the kiosk and get a ticket.",
+    "how to register": "📝 Register at the kiosk and get a ticket.",
+    "triage": "📋 Triage includes weight, height, and blood pressure checks.",
+    "consultation": "👨‍⚕️ Consultations happen after triage. The doctor will call you.",
+    "pharmacy": "💊 Pharmacy is located after consultation.",
+    "lab": "🧪 Lab is on site; doctor will refer if needed.",
+    "payment": "💵 Payment counter is at exit; choose SHA or Other as appropriate."
+}
+
+@st.cache_resource(show_spinner=False)
+def _faq_index():
+    return [(frozenset(k.split()), v) for k, v in FAQ.items()]
+
+def faq_answer(question):
+    """Answer from the FAQ key whose words all appear in the question (most specific wins), else fuzzy-match."""
+    qtok = frozenset(re.findall(r"\w+", question.lower()))
+    best, best_len = None, 0
+    for toks, answer in _faq_index():
+        if len(toks) > best_len and toks <= qtok:
+            best, best_len = answer, len(toks)
+    if best is not None:
+        return best
+    from difflib import get_close_matches
+    match = get_close_matches(question.lower(), FAQ.keys(), n=1, cutoff=0.4)
+    return FAQ[match[0]] if match else None
+
+TTS_TIMEOUT_SECONDS = 3
+# how long a TV render waits on new audio before showing a placeholder; the next tick picks it up
+TTS_WAIT_SECONDS = 1
+TTS_CACHE_SIZE = 64
+
+def _synthesize(text):
+    # imported here: gTTS pulls in requests (~70 ms cold), which only the TV page needs
+    from gtts import gTTS
+    buf = io.BytesIO()
+    # bounded so a slow translate.google.com can't tie up a worker; "en" needs no language check
+    gTTS(text=text, lang="en", lang_check=False, timeout=TTS_TIMEOUT_SECONDS).write_to_fp(buf)
+    return buf.getvalue()
+
+@st.cache_resource(show_spinner=False)
+def _tts_jobs():
+    # process-wide, so every TV tab shares one synthesis per announcement
+    return {"pool": ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts"),
+            "lock": threading.Lock(), "futures": OrderedDict()}
 
 def announce_patient(ticket, name, destination):
-    try:
-        text = f"Now serving ticket number {ticket}, {name}. Please proceed to {destination}."
-        tts = gTTS(text=text, lang="en")
-        filename = "announcement.mp3"
-        tts.save(filename)
-        return filename
-    except Exception as e:
+    """MP3 bytes for the announcement, or None while gTTS is still producing it in the background.
+    Raises if synthesis failed; the failed job is dropped so the next TV tick retries it."""
+    jobs = _tts_jobs()
+    key = (ticket, name, destination)
+    with jobs["lock"]:
+        fut = jobs["futures"].get(key)
+        if fut is None:
+            text = f"Now serving ticket number {ticket}, {name}. Please proceed to {destination}."
+            fut = jobs["futures"][key] = jobs["pool"].submit(_synthesize, text)
+            while len(jobs["futures"]) > TTS_CACHE_SIZE:
+                jobs["futures"].popitem(last=False)
+    wait([fut], timeout=TTS_WAIT_SECONDS)
+    if not fut.done():
         return None
+    if fut.exception() is not None:
+        with jobs["lock"]:
+            if jobs["futures"].get(key) is fut:
+                del jobs["futures"][key]
+    return fut.result()
 
 # ----------------- STREAMLIT UI -----------------
 st.set_page_config(page_title="Smart Queue System", page_icon="🏥", layout="wide")
 
+TV_CSS = """<style>
+@keyframes blinker { 50% { opacity: 0; } }
+.blinking { animation: blinker 1.2s linear infinite; color: red; font-size:60px; text-align:center; }
+.tv-title { text-align:center; font-size:36px; margin-bottom:0.2rem; }
+.tv-sub { text-align:center; font-size:24px; color:blue; }
+</style>"""
+
+TV_REFRESH_SECONDS = 7
+TIP_SECONDS = 15
+TIPS = (
+    "💧 Drink at least 8 glasses of water daily.",
+    "🍎 Eat more fruits and vegetables for better immunity.",
+    "🏃 Exercise 30 minutes daily for heart health.",
+    "🧘 Take deep breaths to reduce stress.",
+    "💉 Keep your vaccinations up to date.",
+)
+
+@st.fragment(run_every=TV_REFRESH_SECONDS)
+def tv_board():
+    """Now Serving banner, announcement and tip; reruns on its own timer without re-executing the whole page."""
+    # Show the next waiting patient (status='waiting'), earliest queue_id
+    nxt = tv_poller()["row"]
+
+    if nxt is not None:
+        _, ticket, name, destination = nxt
+        name = name or "Patient"
+        destination = destination or "Triage"
+
+        # CSS animation + banner as one element; it must be re-emitted every run or Streamlit drops it
+        st.markdown(
+            TV_CSS
+            + "<div class='tv-title'>Now Serving</div>"
+            + f"<div class='blinking'>Ticket {ticket} — {name}</div>"
+            + f"<div class='tv-sub'>Please proceed to {destination}</div>",
+            unsafe_allow_html=True)
+
+        # Audio
+        try:
+            audio_bytes = announce_patient(ticket, name, destination)
+            if audio_bytes is None:
+                st.caption("🔊 Preparing announcement…")
+            else:
+                st.audio(audio_bytes, format="audio/mp3", autoplay=True)
+        except Exception:
+            st.warning("Audio announcement unavailable.")
+    else:
+        st.info("⏳ No waiting patients at the moment. Please relax and enjoy health tips.")
+
+    # rotate on the clock so every TV shows the same tip and it changes every TIP_SECONDS
+    tip = TIPS[int(time.time() // TIP_SECONDS) % len(TIPS)]
+    st.markdown(f"<p style='text-align:center; font-size:20px; color:green;'>{tip}</p>", unsafe_allow_html=True)
+
 menu = st.sidebar.radio("📌 Navigation", [
     "Home", "About", "Kiosk (Entry)", "TV Display", "Triage", "Doctor Panel",
     "Pharmacy", "Lab", "Payment", "Patient Records", "Analytics", "Chatbot", "FAQs", "Contacts"
@@ -229,10 +204,10 @@ if menu == "Home":
         st.markdown("- Doctor records condition and assigns destination.")
         st.markdown("- Destination staff (Pharmacy/Lab/Payment) mark patients done.")
     with col2:
-        qdf = get_queue_df()
-        st.metric("Total Tickets", len(qdf))
-        st.metric("Waiting", int((qdf['status'] == 'waiting').sum() if not qdf.empty else 0))
-        st.metric("Completed", int((qdf['status'] == 'done').sum() if not qdf.empty else 0))
+        total, waiting, completed = queue_counts(data_version())
+        st.metric("Total Tickets", total)
+        st.metric("Waiting", waiting)
+        st.metric("Completed", completed)
 
 # ---------- ABOUT ----------
 elif menu == "About":
@@ -261,62 +236,8 @@ elif menu == "Kiosk (Entry)":
 # ---------- TV DISPLAY ----------
 elif menu == "TV Display":
     st.title("📺 Waiting Room Display")
-    st_autorefresh(interval=7000, key="tvdisplay")
-
-    # Show the next waiting patient (status='waiting'), earliest queue_id
-    next_df = pd.read_sql("""
-        SELECT q.queue_id, q.ticket_number,
-               COALESCE(p.first_name,'') || ' ' || COALESCE(p.middle_name,'') || ' ' || COALESCE(p.surname,'') as full_name,
-               q.destination
-        FROM queue q
-        LEFT JOIN patients p ON q.patient_id = p.id
-        WHERE q.status='waiting'
-        ORDER BY q.queue_id ASC
-        LIMIT 1
-    """, conn)
-
-    if not next_df.empty:
-        ticket = next_df["ticket_number"].iloc[0]
-        name = next_df["full_name"].iloc[0] or "Patient"
-        destination = next_df["destination"].iloc[0] if next_df["destination"].iloc[0] else "Triage"
-
-        # CSS animation
-        st.markdown("""
-            <style>
-            @keyframes blinker { 50% { opacity: 0; } }
-            .blinking { animation: blinker 1.2s linear infinite; color: red; font-size:60px; text-align:center; }
-            .tv-title { text-align:center; font-size:36px; margin-bottom:0.2rem; }
-            .tv-sub { text-align:center; font-size:24px; color:blue; }
-            </style>
-        """, unsafe_allow_html=True)
-
-        st.markdown(f"<div class='tv-title'>Now Serving</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='blinking'>Ticket {ticket} — {name}</div>", unsafe_allow_html=True)
-        st.markdown(f"<div class='tv-sub'>Please proceed to {destination}</div>", unsafe_allow_html=True)
 
-        # Audio
-        audio_file = None
-        try:
-            audio_file = announce_patient(ticket, name, destination)
-            if audio_file:
-                audio_bytes = open(audio_file, "rb").read()
-                st.audio(audio_bytes, format="audio/mp3", autoplay=True)
-        except Exception:
-            st.warning("Audio announcement unavailable.")
-        finally:
-            if audio_file:
-                safe_remove_file(audio_file)
-    else:
-        st.info("⏳ No waiting patients at the moment. Please relax and enjoy health tips.")
-
-    tips = [
-        "💧 Drink at least 8 glasses of water daily.",
-        "🍎 Eat more fruits and vegetables for better immunity.",
-        "🏃 Exercise 30 minutes daily for heart health.",
-        "🧘 Take deep breaths to reduce stress.",
-        "💉 Keep your vaccinations up to date."
-    ]
-    st.markdown(f"<p style='text-align:center; font-size:20px; color:green;'>{random.choice(tips)}</p>", unsafe_allow_html=True)
+    tv_board()
 
 # ---------- TRIAGE ----------
 elif menu == "Triage":
@@ -325,8 +246,10 @@ elif menu == "Triage":
         st.session_state.triage_logged = False
 
     if not st.session_state.triage_logged:
-        pw = st.text_input("Triage Password", type="password")
-        if st.button("Login as Triage"):
+        with st.form("triage_login"):
+            pw = st.text_input("Triage Password", type="password")
+            login = st.form_submit_button("Login as Triage")
+        if login:
             if pw == "triage123":
                 st.session_state.triage_logged = True
                 st.success("✅ Triage login successful")
@@ -334,8 +257,7 @@ elif menu == "Triage":
                 st.error("❌ Wrong password")
     else:
         st.subheader("Triage - record vitals")
-        qdf = get_queue_df()
-        waiting = qdf[(qdf['status'] == 'waiting') & (qdf['location'].isin(['Entry','Triage']))]
+        waiting = get_waiting_df(data_version(), "Triage")
         st.write("Patients waiting for triage:")
         st.dataframe(waiting[["queue_id","ticket_number","patient_id","full_name","location","entry_time"]])
 
@@ -347,8 +269,10 @@ elif menu == "Triage":
             bp = st.text_input("BP (e.g., 120/80)")
             triage_submit = st.form_submit_button("Save Triage Data & Move to Consultation")
             if triage_submit:
-                update_triage_by_ids(int(pid), int(qid), float(weight), float(height), bp)
-                st.success("✅ Triage saved. Patient moved to Consultation queue.")
+                if update_triage_by_ids(int(pid), int(qid), float(weight), float(height), bp):
+                    st.success("✅ Triage saved. Patient moved to Consultation queue.")
+                else:
+                    st.warning("Vitals saved, but no queue entry was found for that Patient ID.")
 
         if st.button("Logout Triage"):
             st.session_state.triage_logged = False
@@ -361,8 +285,10 @@ elif menu == "Doctor Panel":
         st.session_state.doctor_logged = False
 
     if not st.session_state.doctor_logged:
-        pw = st.text_input("Doctor Password", type="password")
-        if st.button("Login as Doctor"):
+        with st.form("doctor_login"):
+            pw = st.text_input("Doctor Password", type="password")
+            login = st.form_submit_button("Login as Doctor")
+        if login:
             if pw == "doctor123":
                 st.session_state.doctor_logged = True
                 st.success("✅ Doctor login successful")
@@ -370,8 +296,7 @@ elif menu == "Doctor Panel":
                 st.error("❌ Wrong password")
     else:
         st.subheader("Patients waiting for consultation")
-        qdf = get_queue_df()
-        consult_wait = qdf[(qdf['status']=='waiting') & (qdf['destination'].isin(['Consultation', None, 'Triage']))]
+        consult_wait = get_waiting_df(data_version(), "Doctor")
         st.dataframe(consult_wait[["queue_id","ticket_number","patient_id","full_name","entry_time"]])
 
         with st.form("doctor_form"):
@@ -381,8 +306,10 @@ elif menu == "Doctor Panel":
             destination = st.selectbox("Send patient to", ["Pharmacy", "Lab", "Payment"])
             doctor_submit = st.form_submit_button("Complete Consultation & Forward")
             if doctor_submit:
-                update_doctor_by_ids(int(pid), condition, destination)
-                st.success(f"✅ Patient forwarded to {destination}")
+                if update_doctor_by_ids(int(pid), condition, destination):
+                    st.success(f"✅ Patient forwarded to {destination}")
+                else:
+                    st.warning("Diagnosis saved, but no queue entry was found for that Patient ID.")
 
         if st.button("Logout Doctor"):
             st.session_state.doctor_logged = False
@@ -395,8 +322,10 @@ elif menu == "Pharmacy":
         st.session_state.pharmacy_logged = False
 
     if not st.session_state.pharmacy_logged:
-        pw = st.text_input("Pharmacy Password", type="password")
-        if st.button("Login as Pharmacy"):
+        with st.form("pharmacy_login"):
+            pw = st.text_input("Pharmacy Password", type="password")
+            login = st.form_submit_button("Login as Pharmacy")
+        if login:
             if pw == "pharmacy123":
                 st.session_state.pharmacy_logged = True
                 st.success("✅ Pharmacy login successful")
@@ -404,18 +333,14 @@ elif menu == "Pharmacy":
                 st.error("❌ Wrong password")
     else:
         st.subheader("Patients to serve at Pharmacy")
-        df = pd.read_sql("""
-            SELECT q.queue_id, q.patient_id, q.ticket_number, q.destination,
-                   COALESCE(p.first_name,'') || ' ' || COALESCE(p.surname,'') as name
-            FROM queue q LEFT JOIN patients p ON q.patient_id=p.id
-            WHERE q.destination='Pharmacy' AND q.status!='done'
-            ORDER BY q.queue_id
-        """, conn)
+        df = get_station_queue("Pharmacy")
         st.dataframe(df)
         qid = st.number_input("Queue ID to mark done (Pharmacy)", min_value=1, step=1)
         if st.button("Mark Pharmacy Done"):
-            mark_done_by_queue(int(qid), "Pharmacy")
-            st.success("✅ Marked as done at Pharmacy")
+            if mark_done_by_queue(int(qid), "Pharmacy"):
+                st.success("✅ Marked as done at Pharmacy")
+            else:
+                st.warning("No open queue entry with that Queue ID.")
         if st.button("Logout Pharmacy"):
             st.session_state.pharmacy_logged = False
 
@@ -426,8 +351,10 @@ elif menu == "Lab":
         st.session_state.lab_logged = False
 
     if not st.session_state.lab_logged:
-        pw = st.text_input("Lab Password", type="password")
-        if st.button("Login as Lab"):
+        with st.form("lab_login"):
+            pw = st.text_input("Lab Password", type="password")
+            login = st.form_submit_button("Login as Lab")
+        if login:
             if pw == "lab123":
                 st.session_state.lab_logged = True
                 st.success("✅ Lab login successful")
@@ -435,18 +362,14 @@ elif menu == "Lab":
                 st.error("❌ Wrong password")
     else:
         st.subheader("Patients to serve at Lab")
-        df = pd.read_sql("""
-            SELECT q.queue_id, q.patient_id, q.ticket_number, q.destination,
-                   COALESCE(p.first_name,'') || ' ' || COALESCE(p.surname,'') as name
-            FROM queue q LEFT JOIN patients p ON q.patient_id=p.id
-            WHERE q.destination='Lab' AND q.status!='done'
-            ORDER BY q.queue_id
-        """, conn)
+        df = get_station_queue("Lab")
         st.dataframe(df)
         qid = st.number_input("Queue ID to mark done (Lab)", min_value=1, step=1)
         if st.button("Mark Lab Done"):
-            mark_done_by_queue(int(qid), "Lab")
-            st.success("✅ Marked as done at Lab")
+            if mark_done_by_queue(int(qid), "Lab"):
+                st.success("✅ Marked as done at Lab")
+            else:
+                st.warning("No open queue entry with that Queue ID.")
         if st.button("Logout Lab"):
             st.session_state.lab_logged = False
 
@@ -457,8 +380,10 @@ elif menu == "Payment":
         st.session_state.payment_logged = False
 
     if not st.session_state.payment_logged:
-        pw = st.text_input("Payment Password", type="password")
-        if st.button("Login as Payment"):
+        with st.form("payment_login"):
+            pw = st.text_input("Payment Password", type="password")
+            login = st.form_submit_button("Login as Payment")
+        if login:
             if pw == "payment123":
                 st.session_state.payment_logged = True
                 st.success("✅ Payment login successful")
@@ -466,20 +391,16 @@ elif menu == "Payment":
                 st.error("❌ Wrong password")
     else:
         st.subheader("Patients Awaiting Payment")
-        df = pd.read_sql("""
-            SELECT q.queue_id, q.patient_id, q.ticket_number, q.destination, q.payment_type,
-                   COALESCE(p.first_name,'') || ' ' || COALESCE(p.surname,'') as name
-            FROM queue q LEFT JOIN patients p ON q.patient_id=p.id
-            WHERE q.destination='Payment' AND q.status!='done'
-            ORDER BY q.queue_id
-        """, conn)
+        df = get_station_queue("Payment")
         st.dataframe(df)
 
         qid = st.number_input("Queue ID to process (Payment)", min_value=1, step=1)
         pay_type = st.radio("Select Payment Type", ["SHA", "Other"], index=1)
         if st.button("Mark Payment Done"):
-            mark_done_by_queue(int(qid), "Payment", payment_type=pay_type)
-            st.success(f"✅ Patient payment recorded as {pay_type}")
+            if mark_done_by_queue(int(qid), "Payment", payment_type=pay_type):
+                st.success(f"✅ Patient payment recorded as {pay_type}")
+            else:
+                st.warning("No open queue entry with that Queue ID.")
         if st.button("Logout Payment"):
             st.session_state.payment_logged = False
 
@@ -488,56 +409,32 @@ elif menu == "Patient Records":
     st.title("📂 Patient Records")
 
     search = st.text_input("Search by First name / Surname / Ticket (partial OK)")
-    qdf = get_queue_df()
-    pdf = pd.read_sql("SELECT * FROM patients", conn)
 
     if search:
-        term = f"%{search.strip().lower()}%"
-        res_pat = pd.read_sql("SELECT * FROM patients WHERE lower(first_name) LIKE ? OR lower(surname) LIKE ?", conn, params=(term,term))
-        res_queue = pd.read_sql("SELECT q.queue_id, q.ticket_number, p.* FROM queue q LEFT JOIN patients p ON q.patient_id=p.id WHERE lower(q.ticket_number) LIKE ?", conn, params=(term,))
+        res_pat, res_queue = search_records(search)
         st.write("Patients matching name:")
         st.dataframe(res_pat)
         st.write("Queue rows matching ticket:")
         st.dataframe(res_queue)
     else:
-        st.dataframe(pdf)
+        st.dataframe(get_patients_df(data_version()))
 
     st.subheader("📤 Upload CSV / Excel to add/update patients")
     file = st.file_uploader("Upload CSV or Excel", type=["csv", "xlsx"])
     if file is not None:
-        if file.name.endswith(".csv"):
-            new_df = pd.read_csv(file)
-        else:
-            new_df = pd.read_excel(file)
+        new_df = read_upload(file)
         st.write("Preview:")
         st.dataframe(new_df.head())
 
         if st.button("Save Uploaded Data"):
-            for _, row in new_df.iterrows():
-                # support full 'name' column by splitting
-                if "name" in row and pd.notna(row["name"]) and ("first_name" not in row or pd.isna(row.get("first_name"))):
-                    fn, mn, sn = split_fullname(row["name"])
-                else:
-                    fn = row.get("first_name", "") or ""
-                    mn = row.get("middle_name", "") or ""
-                    sn = row.get("surname", "") or ""
-                age = int(row.get("age", 0)) if pd.notna(row.get("age", None)) else 0
-                gender = row.get("gender", "") or ""
-                c.execute("SELECT id FROM patients WHERE first_name=? AND surname=? AND age=?", (fn, sn, age))
-                existing = c.fetchone()
-                if existing:
-                    update_patient(existing[0], fn, mn, sn, age, gender,
-                                   row.get("weight", None), row.get("height", None), row.get("bp", None), row.get("condition", None))
-                else:
-                    add_patient(fn, mn, sn, age, gender)
+            upsert_patients(prepare_upload_df(new_df))
             st.success("✅ Uploaded data saved/merged.")
 
     st.subheader("✏️ Manual update")
     pid = st.number_input("Enter Patient ID to fetch", step=1, min_value=1)
     if st.button("Fetch Patient"):
-        pat = pd.read_sql("SELECT * FROM patients WHERE id=?", conn, params=(pid,))
-        if not pat.empty:
-            p = pat.iloc[0]
+        p = get_patient(pid)
+        if p is not None:
             fn = st.text_input("First Name", p["first_name"])
             mn = st.text_input("Middle Name", p["middle_name"] if pd.notna(p["middle_name"]) else "")
             sn = st.text_input("Surname", p["surname"] if pd.notna(p["surname"]) else "")
@@ -554,60 +451,44 @@ elif menu == "Patient Records":
 # ---------- ANALYTICS ----------
 elif menu == "Analytics":
     st.title("📊 Analytics Dashboard")
-    df = get_queue_df()
-    if not df.empty:
-        df["entry_time"] = pd.to_datetime(df["entry_time"], errors="coerce")
-        df["exit_time"] = pd.to_datetime(df["exit_time"], errors="coerce")
-        done = df.dropna(subset=["entry_time","exit_time"]).copy()
-        if not done.empty:
-            done["wait_minutes"] = (done["exit_time"] - done["entry_time"]).dt.total_seconds() / 60
-            st.metric("Average Wait Time (completed)", f"{done['wait_minutes'].mean():.1f} min")
+    total, _, _ = queue_counts(data_version())
+    avg_wait, dest_counts, pay_counts, load = get_analytics(data_version())
+    if total:
+        if avg_wait is not None:
+            st.metric("Average Wait Time (completed)", f"{avg_wait:.1f} min")
 
             # Patients per destination (bar)
-            fig1, ax1 = plt.subplots()
-            done["destination"].fillna("Unknown").value_counts().plot(kind="bar", ax=ax1)
-            ax1.set_ylabel("Number of patients")
-            st.pyplot(fig1)
+            st.bar_chart(dest_counts.rename_axis("destination"), y_label="Number of patients")
 
             # SHA vs Other pie
-            if "payment_type" in done.columns:
-                fig2, ax2 = plt.subplots()
-                done["payment_type"].fillna("Unknown").value_counts().plot(kind="pie", autopct="%1.1f%%", ax=ax2)
-                ax2.set_ylabel("")
-                st.pyplot(fig2)
+            if not pay_counts.empty:
+                pay = pay_counts.rename_axis("payment_type").reset_index(name="patients")
+                st.vega_lite_chart(pay, {
+                    "mark": {"type": "arc", "tooltip": True},
+                    "encoding": {
+                        "theta": {"field": "patients", "type": "quantitative"},
+                        "color": {"field": "payment_type", "type": "nominal"},
+                    },
+                })
         else:
             st.info("No completed records to compute average wait time yet.")
 
         # Queue load by hour
-        df["entry_time"] = pd.to_datetime(df["entry_time"], errors="coerce")
-        df["hour"] = df["entry_time"].dt.hour
-        load = df.groupby("hour").size()
         if not load.empty:
-            fig3, ax3 = plt.subplots()
-            load.plot(kind="line", marker="o", ax=ax3)
-            ax3.set_xlabel("Hour of day")
-            ax3.set_ylabel("Number of arrivals")
-            st.pyplot(fig3)
+            st.line_chart(load, x_label="Hour of day", y_label="Number of arrivals")
     else:
         st.info("No queue data yet for analytics.")
 
 # ---------- CHATBOT ----------
 elif menu == "Chatbot":
     st.title("🤖 Hospital Chatbot (FAQ)")
-    faq = {
-        "register": "📝 Register at the kiosk and get a ticket.",
-        "how to register": "📝 Register at the kiosk and get a ticket.",
-        "triage": "📋 Triage includes weight, height, and blood pressure checks.",
-        "consultation": "👨‍⚕️ Consultations happen after triage. The doctor will call you.",
-        "pharmacy": "💊 Pharmacy is located after consultation.",
-        "lab": "🧪 Lab is on site; doctor will refer if needed.",
-        "payment": "💵 Payment counter is at exit; choose SHA or Other as appropriate."
-    }
-    q = st.text_input("Ask me something...")
-    if q:
-        match = get_close_matches(q.lower(), faq.keys(), n=1, cutoff=0.4)
-        if match:
-            st.info(faq[match[0]])
+    with st.form("chatbot_form"):
+        q = st.text_input("Ask me something...")
+        asked = st.form_submit_button("Ask")
+    if asked and q:
+        answer = faq_answer(q)
+        if answer:
+            st.info(answer)
         else:
             st.info("I’m still learning 🤖. For complex questions please ask the reception desk.")
 
@@ -0,0 +1,570 @@
+# db.py - SQLite connection, schema migration and queue/patient queries for the Smart Queue System
+import streamlit as st
+import sqlite3
+import pandas as pd
+import re
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue
+
+# ----------------- DB SETUP & MIGRATION -----------------
+DB_PATH = "hospital.db"
+# memory-map up to 256 MB of the file so page reads skip the read() syscall and copy
+MMAP_SIZE = 256 * 1024 * 1024
+
+@st.cache_resource(show_spinner=False)
+def get_conn():
+    # one connection per process, shared by every session (and kept across module reloads).
+    # The RLock serializes transactions on it: every script thread shares `conn`, and without the lock
+    # one session's statements can land inside another session's open transaction and be committed
+    # or rolled back with it. It is created here so the two can never be replaced separately.
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return conn, conn.cursor(), threading.RLock()
+
+# bound once at import: "Clear cache" empties st.cache_resource, but these module globals (and
+# the pool and poller below) keep the connection, lock and threads already in use
+conn, c, _write_lock = get_conn()
+
+READ_POOL_SIZE = 4
+
+def _open_reader():
+    # read-only and memory-mapped; under WAL it never waits on the writer `conn`
+    rconn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False, cached_statements=256)
+    rconn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return rconn
+
+@st.cache_resource(show_spinner=False)
+def _read_pool():
+    # reader connections for the page queries
+    pool = Queue()
+    for _ in range(READ_POOL_SIZE):
+        pool.put(_open_reader())
+    return pool
+
+_pool = _read_pool()
+
+@contextmanager
+def write_txn():
+    """Serialize a read-modify-write on the shared connection and commit it as one transaction."""
+    with _write_lock, conn:
+        yield conn
+
+@contextmanager
+def read_conn():
+    rconn = _pool.get()
+    try:
+        yield rconn
+    finally:
+        _pool.put(rconn)
+
+def table_columns(table):
+    c.execute(f"PRAGMA table_info({table})")
+    return [r[1] for r in c.fetchall()]
+
+# "first [middle ]surname" over patients aliased as p
+FULL_NAME_SQL = "TRIM(COALESCE(p.first_name,'') || ' ' || COALESCE(NULLIF(p.middle_name,'') || ' ','') || COALESCE(p.surname,''))"
+
+# (index, table, column) used only by the LIKE search fallback when FTS5 is unavailable
+_NOCASE_INDEXES = [
+    ("ix_patients_first_nocase", "patients", "first_name"),
+    ("ix_patients_surname_nocase", "patients", "surname"),
+    ("ix_queue_ticket_nocase", "queue", "ticket_number"),
+]
+
+# bump whenever a migration step is added below
+SCHEMA_VERSION = 4
+
+@st.cache_resource(show_spinner=False)
+def migrate_once():
+    """Bring the schema up to SCHEMA_VERSION; returns whether FTS5 search is available."""
+    # already migrated: skip all the metadata probing
+    if c.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return True
+
+    # Create or migrate patients table
+    c.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    existing_tables = [r[0] for r in c.fetchall()]
+
+    if "patients" in existing_tables:
+        pcols = table_columns("patients")
+        if "name" in pcols and "first_name" not in pcols:
+            # migrate old patients -> new structure
+            c.execute("ALTER TABLE patients RENAME TO patients_old")
+            conn.commit()
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS patients (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    first_name TEXT,
+                    middle_name TEXT,
+                    surname TEXT,
+                    age INTEGER,
+                    gender TEXT,
+                    weight REAL,
+                    height REAL,
+                    bp TEXT,
+                    condition TEXT
+                )
+            ''')
+            conn.commit()
+            c.execute("SELECT id, name, age, gender, condition FROM patients_old")
+            for row in c.fetchall():
+                _, fullname, age, gender, condition = row
+                if fullname and isinstance(fullname, str):
+                    parts = fullname.strip().split()
+                    if len(parts) == 1:
+                        first, middle, surname = parts[0], "", ""
+                    elif len(parts) == 2:
+                        first, middle, surname = parts[0], "", parts[1]
+                    else:
+                        first, middle, surname = parts[0], " ".join(parts[1:-1]), parts[-1]
+                else:
+                    first = middle = surname = ""
+                c.execute("""
+                    INSERT INTO patients (first_name, middle_name, surname, age, gender, condition)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (first, middle, surname, age, gender, condition))
+            conn.commit()
+            c.execute("DROP TABLE IF EXISTS patients_old")
+            conn.commit()
+    else:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS patients (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                first_name TEXT,
+                middle_name TEXT,
+                surname TEXT,
+                age INTEGER,
+                gender TEXT,
+                weight REAL,
+                height REAL,
+                bp TEXT,
+                condition TEXT
+            )
+        ''')
+        conn.commit()
+
+    # Create or migrate queue table
+    if "queue" not in existing_tables:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS queue (
+                queue_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER,
+                ticket_number TEXT,
+                entry_time TEXT,
+                exit_time TEXT,
+                location TEXT,
+                status TEXT DEFAULT "waiting",
+                destination TEXT,
+                payment_type TEXT,
+                full_name TEXT,
+                FOREIGN KEY(patient_id) REFERENCES patients(id)
+            )
+        ''')
+        conn.commit()
+    else:
+        qcols = table_columns("queue")
+        # add columns if missing
+        for col_def in [("ticket_number", "TEXT"), ("entry_time", "TEXT"), ("exit_time", "TEXT"),
+                        ("location", "TEXT"), ("destination", "TEXT"), ("payment_type", "TEXT"),
+                        ("full_name", "TEXT")]:
+            col, dtype = col_def
+            if col not in qcols:
+                try:
+                    c.execute(f"ALTER TABLE queue ADD COLUMN {col} {dtype}")
+                except Exception:
+                    pass
+        # if old 'time' exists, copy it to entry_time where entry_time is null
+        if "time" in qcols and "entry_time" in qcols:
+            try:
+                c.execute("UPDATE queue SET entry_time = time WHERE (entry_time IS NULL OR entry_time='') AND time IS NOT NULL")
+            except Exception:
+                pass
+        if "full_name" not in qcols:
+            c.execute(f"UPDATE queue SET full_name = (SELECT {FULL_NAME_SQL} FROM patients p WHERE p.id = queue.patient_id)")
+        conn.commit()
+
+    # keep queue.full_name denormalized so the station/TV reads are single-table
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS queue_full_name_ai AFTER INSERT ON queue BEGIN
+            UPDATE queue SET full_name = (SELECT {FULL_NAME_SQL} FROM patients p WHERE p.id = new.patient_id)
+            WHERE queue_id = new.queue_id;
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS patients_full_name_au AFTER UPDATE OF first_name, middle_name, surname ON patients BEGIN
+            UPDATE queue SET full_name = (SELECT {FULL_NAME_SQL} FROM patients p WHERE p.id = new.id)
+            WHERE patient_id = new.id;
+        END
+    """)
+    conn.commit()
+
+    # indexes for the dashboard/TV filters and the upload dedupe lookup
+    # superseded by ix_queue_open_dest below; nothing plans on it, so it was only write overhead
+    c.execute("DROP INDEX IF EXISTS ix_queue_dest_status")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_queue_status_qid ON queue(status, queue_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_queue_patient ON queue(patient_id)")
+    # station lists read only open rows in queue_id order; partial so finished visits don't bloat it
+    c.execute("CREATE INDEX IF NOT EXISTS ix_queue_open_dest ON queue(destination, queue_id) WHERE status!='done'")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_patients_first_surname_age ON patients(first_name, surname, age)")
+    conn.commit()
+
+    # full-text indexes for Patient Records search, kept in sync by triggers
+    try:
+        if "patients_fts" not in existing_tables:
+            c.executescript("""
+                CREATE VIRTUAL TABLE patients_fts USING fts5(
+                    first_name, middle_name, surname, content='patients', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN
+                    INSERT INTO patients_fts(rowid, first_name, middle_name, surname)
+                    VALUES (new.id, new.first_name, new.middle_name, new.surname);
+                END;
+                CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+                    INSERT INTO patients_fts(patients_fts, rowid, first_name, middle_name, surname)
+                    VALUES ('delete', old.id, old.first_name, old.middle_name, old.surname);
+                END;
+                CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF first_name, middle_name, surname ON patients BEGIN
+                    INSERT INTO patients_fts(patients_fts, rowid, first_name, middle_name, surname)
+                    VALUES ('delete', old.id, old.first_name, old.middle_name, old.surname);
+                    INSERT INTO patients_fts(rowid, first_name, middle_name, surname)
+                    VALUES (new.id, new.first_name, new.middle_name, new.surname);
+                END;
+                INSERT INTO patients_fts(patients_fts) VALUES ('rebuild');
+            """)
+        if "queue_fts" not in existing_tables:
+            c.executescript("""
+                CREATE VIRTUAL TABLE queue_fts USING fts5(
+                    ticket_number, content='queue', content_rowid='queue_id');
+                CREATE TRIGGER IF NOT EXISTS queue_fts_ai AFTER INSERT ON queue BEGIN
+                    INSERT INTO queue_fts(rowid, ticket_number) VALUES (new.queue_id, new.ticket_number);
+                END;
+                CREATE TRIGGER IF NOT EXISTS queue_fts_ad AFTER DELETE ON queue BEGIN
+                    INSERT INTO queue_fts(queue_fts, rowid, ticket_number) VALUES ('delete', old.queue_id, old.ticket_number);
+                END;
+                CREATE TRIGGER IF NOT EXISTS queue_fts_au AFTER UPDATE OF ticket_number ON queue BEGIN
+                    INSERT INTO queue_fts(queue_fts, rowid, ticket_number) VALUES ('delete', old.queue_id, old.ticket_number);
+                    INSERT INTO queue_fts(rowid, ticket_number) VALUES (new.queue_id, new.ticket_number);
+                END;
+                INSERT INTO queue_fts(queue_fts) VALUES ('rebuild');
+            """)
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5; search falls back to LIKE and user_version stays put.
+        # NOCASE indexes let that fallback run its prefix LIKE as an index range
+        for name, table, col in _NOCASE_INDEXES:
+            c.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({col} COLLATE NOCASE)")
+        conn.commit()
+        return False
+    # FTS serves search, so the LIKE-fallback indexes would only slow down writes
+    for name, _, _ in _NOCASE_INDEXES:
+        c.execute(f"DROP INDEX IF EXISTS {name}")
+    # refresh planner statistics so the new indexes actually get picked
+    c.execute("ANALYZE")
+    c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    return True
+
+HAS_FTS = migrate_once()
+
+def ticket_for(queue_id):
+    return f"T{queue_id:08d}"
+
+# entry/exit timestamps are stamped by SQLite itself, in local time like the rows written before;
+# julianday() and strftime() in the analytics SQL parse this format
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')"
+
+# ----------------- CRUD / FLOW FUNCTIONS -----------------
+@st.cache_resource(show_spinner=False)
+def _data_version():
+    # process-wide counter so a write in one session invalidates cached reads in all of them
+    return {"value": 0}
+
+def data_version():
+    # the counter tracks this process's writes; PRAGMA data_version moves when any other connection
+    # (a second server process, a sqlite3 shell, an import script) commits to the same file
+    return _data_version()["value"], conn.execute("PRAGMA data_version").fetchone()[0]
+
+def bump_data_version():
+    _data_version()["value"] += 1
+
+# SQL kept as module constants so every call hands sqlite3 the identical string and hits its statement cache
+_SQL_ADD_PATIENT = "INSERT INTO patients (first_name, middle_name, surname, age, gender) VALUES (?, ?, ?, ?, ?)"
+_SQL_UPDATE_PATIENT = """
+    UPDATE patients
+    SET first_name=?, middle_name=?, surname=?, age=?, gender=?, weight=?, height=?, bp=?, condition=?
+    WHERE id=?
+"""
+_SQL_UPLOAD_INSERT = """
+    INSERT INTO patients (first_name, middle_name, surname, age, gender, weight, height, bp, condition)
+    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+    WHERE NOT EXISTS (SELECT 1 FROM patients WHERE first_name=? AND surname=? AND age=?)
+"""
+_SQL_UPLOAD_UPDATE = """
+    UPDATE patients
+    SET middle_name=?, gender=?, weight=?, height=?, bp=?, condition=?
+    WHERE id=(SELECT MIN(id) FROM patients WHERE first_name=? AND surname=? AND age=?)
+"""
+_SQL_ADD_TO_QUEUE = ("INSERT INTO queue (patient_id, entry_time, location, destination, status) "
+                     f"VALUES (?, {NOW_SQL}, ?, ?, ?) RETURNING queue_id")
+_SQL_SET_TICKET = "UPDATE queue SET ticket_number=? WHERE queue_id=?"
+_SQL_TRIAGE_PATIENT = "UPDATE patients SET weight=?, height=?, bp=? WHERE id=?"
+_SQL_TRIAGE_QUEUE = ("UPDATE queue SET location='Triage', destination='Consultation' WHERE patient_id=? "
+                     "RETURNING ticket_number")
+_SQL_DOCTOR_PATIENT = "UPDATE patients SET condition=? WHERE id=?"
+_SQL_DOCTOR_QUEUE = ("UPDATE queue SET location='Doctor', destination=?, status='waiting' WHERE patient_id=? "
+                     "RETURNING ticket_number")
+# conditional on status so two desks can't both close the same visit; RETURNING says whether we won
+_SQL_MARK_DONE_PAYMENT = (f"UPDATE queue SET location=?, status='done', exit_time={NOW_SQL}, payment_type=? "
+                          "WHERE queue_id=? AND status!='done' RETURNING ticket_number")
+_SQL_MARK_DONE = (f"UPDATE queue SET location=?, status='done', exit_time={NOW_SQL} "
+                  "WHERE queue_id=? AND status!='done' RETURNING ticket_number")
+# each list is filtered before the LIMIT, so open Pharmacy/Lab/Payment rows can't crowd new arrivals out
+_SQL_WAITING = {
+    "Triage": """
+        SELECT queue_id, patient_id, ticket_number, full_name, location, destination, entry_time
+        FROM queue
+        WHERE status='waiting' AND location IN ('Entry', 'Triage')
+        ORDER BY queue_id ASC
+        LIMIT 500
+    """,
+    "Doctor": """
+        SELECT queue_id, patient_id, ticket_number, full_name, location, destination, entry_time
+        FROM queue
+        WHERE status='waiting' AND (destination IN ('Consultation', 'Triage') OR destination IS NULL)
+        ORDER BY queue_id ASC
+        LIMIT 500
+    """,
+}
+_SQL_QUEUE_COUNTS = "SELECT COUNT(*), COALESCE(SUM(status='waiting'), 0), COALESCE(SUM(status='done'), 0) FROM queue"
+_SQL_PATIENT_BY_ID = "SELECT * FROM patients WHERE id=?"
+_SQL_QUEUE_NEW_PATIENTS = f"""
+    INSERT INTO queue (patient_id, entry_time, location, destination, status)
+    SELECT id, {NOW_SQL}, 'Entry', 'Triage', 'waiting' FROM patients WHERE id > ? ORDER BY id
+"""
+_SQL_SET_NEW_TICKETS = ("UPDATE queue SET ticket_number = printf('T%08d', queue_id) WHERE queue_id > ? "
+                        "RETURNING ticket_number")
+
+def add_patient(first_name, middle_name, surname, age, gender):
+    with write_txn():
+        cur = conn.execute(_SQL_ADD_PATIENT, (first_name, middle_name, surname, age, gender))
+    bump_data_version()
+    return cur.lastrowid
+
+def add_patients_bulk(rows):
+    """Register (first_name, middle_name, surname, age, gender) walk-ins and queue them at Triage
+    in one transaction; returns their tickets in arrival order."""
+    with write_txn():
+        # take SQLite's write lock before reading the maxima: ids are AUTOINCREMENT, so with no other
+        # connection or process able to insert, everything above them is ours.
+        # the printf() format must stay in step with ticket_for()
+        conn.execute("BEGIN IMMEDIATE")
+        last_pid = conn.execute("SELECT COALESCE(MAX(id), 0) FROM patients").fetchone()[0]
+        last_qid = conn.execute("SELECT COALESCE(MAX(queue_id), 0) FROM queue").fetchone()[0]
+        conn.executemany(_SQL_ADD_PATIENT, rows)
+        conn.execute(_SQL_QUEUE_NEW_PATIENTS, (last_pid,))
+        tickets = sorted(r[0] for r in conn.execute(_SQL_SET_NEW_TICKETS, (last_qid,)).fetchall())
+    bump_data_version()
+    return tickets
+
+def update_patient(pid, first_name, middle_name, surname, age, gender, weight=None, height=None, bp=None, condition=None):
+    with write_txn():
+        conn.execute(_SQL_UPDATE_PATIENT, (first_name, middle_name, surname, age, gender, weight, height, bp, condition, pid))
+    bump_data_version()
+
+def upsert_patients(df):
+    """Insert new patients and update existing ones (matched on first_name, surname, age) in one transaction."""
+    rows = list(df.itertuples(index=False, name=None))
+    with write_txn():
+        conn.executemany(_SQL_UPLOAD_INSERT, [r + (r[0], r[2], r[3]) for r in rows])
+        conn.executemany(_SQL_UPLOAD_UPDATE, [(r[1], r[4], r[5], r[6], r[7], r[8], r[0], r[2], r[3]) for r in rows])
+    bump_data_version()
+
+def add_to_queue(patient_id, destination=None):
+    loc = "Entry"
+    dest = destination or "Triage"
+    # the ticket is derived from the autoincrement id, so it is unique and monotonic
+    with write_txn():
+        queue_id = conn.execute(_SQL_ADD_TO_QUEUE, (patient_id, loc, dest, "waiting")).fetchone()[0]
+        ticket = ticket_for(queue_id)
+        conn.execute(_SQL_SET_TICKET, (ticket, queue_id))
+    bump_data_version()
+    return ticket
+
+def update_triage_by_ids(patient_id, queue_id=None, weight=None, height=None, bp=None):
+    """Record vitals and move the patient's queue row(s) to Consultation; returns the moved tickets."""
+    with write_txn():
+        conn.execute(_SQL_TRIAGE_PATIENT, (weight, height, bp, patient_id))
+        # update queue row(s)
+        tickets = [r[0] for r in conn.execute(_SQL_TRIAGE_QUEUE, (patient_id,)).fetchall()]
+    bump_data_version()
+    return tickets
+
+def update_doctor_by_ids(patient_id, condition, destination):
+    """Record the diagnosis and forward the patient's queue row(s); returns the forwarded tickets."""
+    with write_txn():
+        conn.execute(_SQL_DOCTOR_PATIENT, (condition, patient_id))
+        tickets = [r[0] for r in conn.execute(_SQL_DOCTOR_QUEUE, (destination, patient_id)).fetchall()]
+    bump_data_version()
+    return tickets
+
+def mark_done_by_queue(queue_id, section, payment_type=None):
+    """Close an open queue row; returns its ticket, or None if it doesn't exist or was already done."""
+    with write_txn():
+        if section == "Payment" and payment_type:
+            row = conn.execute(_SQL_MARK_DONE_PAYMENT, (section, payment_type, queue_id)).fetchone()
+        else:
+            row = conn.execute(_SQL_MARK_DONE, (section, queue_id)).fetchone()
+    if row is None:
+        return None
+    bump_data_version()
+    return row[0]
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_waiting_df(ver, station):
+    """Waiting rows for the 'Triage' or 'Doctor' list; full_name is denormalized so no JOIN is needed."""
+    try:
+        return rows_df(_SQL_WAITING[station])
+    except Exception as e:
+        st.error(f"DB error: {e}")
+        return pd.DataFrame()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def queue_counts(ver):
+    # one scan instead of three COUNT(*) statements
+    with read_conn() as rconn:
+        total, waiting, done = rconn.execute(_SQL_QUEUE_COUNTS).fetchone()
+    return total, waiting, done
+
+_SQL_NEXT_WAITING = ("SELECT queue_id, ticket_number, full_name, destination FROM queue "
+                     "WHERE status='waiting' ORDER BY queue_id LIMIT 1")
+TV_POLL_SECONDS = 2
+_poller = None
+_poller_lock = threading.Lock()
+
+def tv_poller():
+    """Shared {'row': (queue_id, ticket, name, destination) or None}, refreshed by one daemon thread per process."""
+    # a module global rather than st.cache_resource, so clearing the cache can't start a second thread
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = _start_tv_poller()
+    return _poller
+
+def _start_tv_poller():
+    # from the read pool, so a write still open on `conn` can't surface a row that may be rolled back
+    with read_conn() as rconn:
+        state = {"row": rconn.execute(_SQL_NEXT_WAITING).fetchone()}
+
+    def loop():
+        # own reader connection, held for the thread's lifetime rather than borrowed from the pool
+        poll_conn = _open_reader()
+        seen = None
+        while True:
+            time.sleep(TV_POLL_SECONDS)
+            try:
+                # data_version only moves when another connection commits, so an idle queue costs one PRAGMA
+                version = poll_conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != seen:
+                    state["row"] = poll_conn.execute(_SQL_NEXT_WAITING).fetchone()
+                    seen = version
+            except sqlite3.Error:
+                pass
+
+    threading.Thread(target=loop, name="tv-poller", daemon=True).start()
+    return state
+
+# every dashboard aggregate in one statement, tagged so the rows can be split back apart
+_SQL_ANALYTICS = """
+    WITH q AS (
+        SELECT destination, payment_type, entry_time,
+               julianday(exit_time) - julianday(entry_time) AS wait_days
+        FROM queue
+    ), done AS (SELECT * FROM q WHERE wait_days IS NOT NULL)
+    SELECT 'wait' AS tag, NULL AS k, AVG(wait_days) * 1440.0 AS v FROM done
+    UNION ALL
+    SELECT 'dest', COALESCE(destination, 'Unknown'), COUNT(*) FROM done GROUP BY 2
+    UNION ALL
+    SELECT 'pay', COALESCE(payment_type, 'Unknown'), COUNT(*) FROM done GROUP BY 2
+    UNION ALL
+    SELECT 'hour', CAST(strftime('%H', entry_time) AS INTEGER), COUNT(*) FROM q
+    WHERE strftime('%H', entry_time) IS NOT NULL GROUP BY 2
+"""
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_analytics(ver):
+    """Average wait (minutes, None if nothing completed), completed visits per destination and
+    payment type, and arrivals per hour; all computed in SQLite in a single round-trip."""
+    df = rows_df(_SQL_ANALYTICS)
+    by_tag = {tag: g.set_index("k")["v"] for tag, g in df.groupby("tag", sort=False)}
+    avg_wait = by_tag["wait"].iloc[0]
+    avg_wait = None if pd.isna(avg_wait) else float(avg_wait)
+    counts = {tag: by_tag.get(tag, pd.Series(dtype="float64")).astype("int64") for tag in ("dest", "pay", "hour")}
+    load = counts["hour"]
+    load.index = load.index.astype("int64")
+    return avg_wait, counts["dest"], counts["pay"], load.sort_index()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def get_patients_df(ver):
+    with read_conn() as rconn:
+        return pd.read_sql("SELECT * FROM patients", rconn)
+
+_SQL_STATION_QUEUE = """
+    SELECT queue_id, patient_id, ticket_number, destination, full_name AS name
+    FROM queue
+    WHERE destination=? AND status!='done'
+    ORDER BY queue_id
+"""
+_SQL_PAYMENT_QUEUE = """
+    SELECT queue_id, patient_id, ticket_number, destination, payment_type, full_name AS name
+    FROM queue
+    WHERE destination='Payment' AND status!='done'
+    ORDER BY queue_id
+"""
+
+def rows_df(sql, params=()):
+    # small result sets: build the frame straight from fetchall(), skipping pd.read_sql's generic ingestion
+    with read_conn() as rconn:
+        cur = rconn.execute(sql, params)
+        return pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+
+def fts_prefix_query(text):
+    # quote each word so user input can't inject FTS5 syntax; '*' makes it a prefix match
+    return " ".join(f'"{tok}"*' for tok in re.findall(r"\w+", text))
+
+def search_records(text):
+    """Patients matching the name and queue rows matching the ticket, via FTS5 prefix match when available."""
+    match = fts_prefix_query(text) if HAS_FTS else ""
+    if match:
+        res_pat = rows_df("""
+            SELECT p.* FROM patients_fts f JOIN patients p ON p.id = f.rowid
+            WHERE patients_fts MATCH ? ORDER BY p.id
+        """, (match,))
+        res_queue = rows_df("""
+            SELECT q.queue_id, q.ticket_number, p.* FROM queue_fts f
+            JOIN queue q ON q.queue_id = f.rowid LEFT JOIN patients p ON q.patient_id = p.id
+            WHERE queue_fts MATCH ? ORDER BY q.queue_id
+        """, (match,))
+    else:
+        # narrower than the FTS path: the whole input must prefix first_name or surname (no middle name,
+        # no per-word match); LIKE is case-insensitive and uses the NOCASE indexes
+        term = f"{text.strip()}%"
+        res_pat = rows_df("SELECT * FROM patients WHERE first_name LIKE ? OR surname LIKE ?", (term, term))
+        res_queue = rows_df("SELECT q.queue_id, q.ticket_number, p.* FROM queue q LEFT JOIN patients p ON q.patient_id=p.id WHERE q.ticket_number LIKE ?", (term,))
+    return res_pat, res_queue
+
+def get_station_queue(destination):
+    """Open rows for a Pharmacy/Lab/Payment desk; the Payment list also carries payment_type."""
+    if destination == "Payment":
+        return rows_df(_SQL_PAYMENT_QUEUE)
+    return rows_df(_SQL_STATION_QUEUE, (destination,))
+
+def get_patient(pid):
+    """One patient as a {column: value} dict, or None; a single row doesn't need a DataFrame."""
+    with read_conn() as rconn:
+        cur = rconn.execute(_SQL_PATIENT_BY_ID, (pid,))
+        row = cur.fetchone()
+    return None if row is None else dict(zip((d[0] for d in cur.description), row))